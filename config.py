@@ -1,6 +1,10 @@
 import os
+import atexit
+import locale
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -14,7 +18,15 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set.")
 
-engine = create_engine(DATABASE_URL)
+# One engine per process. A larger compiled-statement cache keeps every
+# repeated import statement compiled, and multi-row INSERTs are sent in
+# pages of 1000 rows (insertmanyvalues).
+engine = create_engine(
+    DATABASE_URL,
+    query_cache_size=1200,
+    insertmanyvalues_page_size=1000,
+    pool_pre_ping=True
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -32,6 +44,72 @@ if not os.path.exists(LOG_DIR):
     except OSError as e:
         print(f"Error creating log directory 'logs': {e}. Please create it manually.")
 
+class FastRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler tuned for chatty DEBUG logging.
+    - The file size is tracked in memory, so the file is only stat'ed when a
+      rollover is actually due (same reordering as upstream CPython).
+    - Writes go through a `buffer_size` buffer instead of a flush per record.
+      ERROR and above are flushed immediately, everything else at least every
+      `flush_interval` seconds and on close (logging.shutdown runs at exit).
+    """
+    def __init__(self, filename, buffer_size=64*1024, flush_interval=30.0, **kwargs):
+        self.buffer_size = buffer_size
+        self._size = 0
+        super().__init__(filename, **kwargs)
+        self._stop_flushing = threading.Event()
+        if flush_interval > 0:
+            threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                             name='log-flush', daemon=True).start()
+
+    def _open(self):
+        stream = open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                      encoding=self.encoding, errors=self.errors)
+        self._size = os.path.getsize(self.baseFilename)
+        return stream
+
+    def _encoded_len(self, msg):
+        """Size of msg in the file, in bytes (maxBytes and getsize count bytes, not characters)."""
+        if self.stream is not None:
+            return len(msg.encode(self.stream.encoding, self.stream.errors or 'strict'))
+        return len(msg.encode(self.encoding or locale.getpreferredencoding(False), self.errors or 'strict'))
+
+    def _rollover_due(self, msg_len):
+        if self.maxBytes <= 0 or self._size + msg_len < self.maxBytes:
+            return False
+        # Never rollover anything other than regular files
+        if os.path.exists(self.baseFilename) and not os.path.isfile(self.baseFilename):
+            return False
+        return True
+
+    def shouldRollover(self, record):
+        return self._rollover_due(self._encoded_len("%s\n" % self.format(record)))
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            msg_len = self._encoded_len(msg)
+            if self._rollover_due(msg_len):
+                self.doRollover()
+            self.stream.write(msg)
+            self._size += msg_len
+            if record.levelno >= logging.ERROR:
+                self.stream.flush()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+    def _flush_periodically(self, interval):
+        while not self._stop_flushing.wait(interval):
+            self.flush()
+
+    def close(self):
+        self._stop_flushing.set()
+        super().close()
+
 # Create a logger
 logger = logging.getLogger('importer')
 logger.setLevel(logging.DEBUG)  # Capture all levels
@@ -45,19 +123,24 @@ ch.setFormatter(ch_format)
 # Create file handler and set level to DEBUG
 log_file = os.path.join(LOG_DIR, 'import.log')
 # RotatingFileHandler: max 5MB per file, keep 3 backup files
+log_handlers = [ch]
 try:
-    fh = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=3)
+    fh = FastRotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=3)
     fh.setLevel(logging.DEBUG)
     fh_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     fh.setFormatter(fh_format)
-    # Add handlers to logger
-    if not logger.handlers:
-        logger.addHandler(ch)
-        logger.addHandler(fh)
+    log_handlers.append(fh)
 except Exception as e:
     print(f"Error setting up file logger. Check permissions for 'logs' directory. {e}")
-    if not logger.handlers:
-        logger.addHandler(ch)
+
+# The logger only enqueues records; formatting and I/O for the console/file
+# handlers happen on a background QueueListener thread.
+if not logger.handlers:
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop) # Drain the queue on shutdown
 
 # --- QuickBooks Config ---
 # Load all QB settings
@@ -68,6 +151,10 @@ QB_REDIRECT_URI = os.getenv("QB_REDIRECT_URI")
 QB_ACCESS_TOKEN = os.getenv("QB_ACCESS_TOKEN")
 QB_REFRESH_TOKEN = os.getenv("QB_REFRESH_TOKEN")
 QB_REALM_ID = os.getenv("QB_REALM_ID")
+# SQLite file that holds refreshed tokens (see quickbooks_client.update_tokens)
+QB_TOKEN_DB = os.getenv("QB_TOKEN_DB", "tokens.db")
+# Development aid: fetch every Invoice field instead of only those the import reads
+QB_SELECT_ALL_FIELDS = os.getenv("QB_SELECT_ALL_FIELDS", "").lower() in ("1", "true", "yes")
 
 def all_qb_keys_present():
     """Check if main keys for running the script are in .env"""
@@ -7,7 +7,8 @@ from urllib.parse import urlparse, parse_qs
 from intuitlib.client import AuthClient
 from intuitlib.enums import Scopes
 
-from config import QB_CLIENT_ID, QB_CLIENT_SECRET, QB_REDIRECT_URI, QB_ENVIRONMENT, auth_keys_present
+from config import QB_CLIENT_ID, QB_CLIENT_SECRET, QB_REDIRECT_URI, QB_ENVIRONMENT, QB_TOKEN_DB, auth_keys_present
+from quickbooks_client import update_tokens
 
 # This script runs a temporary web server to catch the OAuth redirect
 # It's the easiest way to get the initial code and realmId
@@ -88,6 +89,8 @@ def get_tokens():
         print("Exchanging authorization code for tokens...")
         try:
             auth_client.get_bearer_token(auth_code, realm_id=realm_id)
+            # Replace any older tokens in the store so the importer uses these
+            update_tokens(auth_client.access_token, auth_client.refresh_token)
             
             print("\n--- SUCCESS! ---")
             print("Your tokens are ready. Copy these values into your .env file:\n")
@@ -96,6 +99,7 @@ def get_tokens():
             print(f"QB_REFRESH_TOKEN={auth_client.refresh_token}")
             print(f"QB_REALM_ID={auth_client.realm_id}")
             print("--------------------------------------------------")
+            print(f"(The tokens were also saved to {QB_TOKEN_DB}, which the importer reads first.)")
             
         except Exception as e:
             print(f"\nError getting tokens: {e}")
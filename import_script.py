@@ -1,10 +1,16 @@
 import argparse
 import datetime
+import os
 import uuid
 import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 from azure.storage.blob import BlobServiceClient, ContentSettings
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, lazyload, selectinload
 from sqlalchemy.exc import IntegrityError
 from quickbooks.objects.invoice import Invoice
 from quickbooks.objects.purchaseorder import PurchaseOrder
@@ -16,57 +22,105 @@ import config
 import models
 import quickbooks_client as qb
 
+ATTACHMENT_WORKERS = 8 # Concurrent attachment downloads/uploads
+VERIFY_YIELD_PER = 1000 # Invoices streamed per round trip by verify_imports
+COMMIT_BATCH_SIZE = 50 # Invoices per DB commit; each invoice runs in its own SAVEPOINT
+INVOICE_PREFETCH_PAGES = 2 # QB invoice pages fetched ahead of the DB work
+
+# Line item Decimal constants, built once instead of per line
+_TAX_ZERO = Decimal("0.00")
+_TAX_STD = Decimal("0.05") # Flat rate assumed for any taxed line (see process_lpo_items)
+_AMOUNT_ZERO = Decimal("0.0")
+
+# QB Item Type -> Material 'unit'; anything else defaults to 'nos'
+# (Inventory items could carry a real UOM field in QB)
+_UNIT_BY_QB_TYPE = {
+    'Service': 'service',
+    'Inventory': 'each',
+}
+
+# File extension -> blob Content-Type; anything else is uploaded as octet-stream
+CONTENT_TYPES = {
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+}
+
 # --- Helper Functions ---
 
-def get_azure_blob_service_client():
-    """Initializes and returns the Azure BlobServiceClient."""
+def get_azure_container_client():
+    """
+    Initializes and returns the Azure ContainerClient for AZURE_CONTAINER_NAME.
+    Created once per run and reused for every upload.
+    """
     if not config.AZURE_CONNECTION_STRING:
         config.logger.warning("Azure Connection String not configured. Cannot upload attachments.")
         return None
     try:
-        return BlobServiceClient.from_connection_string(config.AZURE_CONNECTION_STRING)
+        blob_service_client = BlobServiceClient.from_connection_string(config.AZURE_CONNECTION_STRING)
+        return blob_service_client.get_container_client(config.AZURE_CONTAINER_NAME)
     except Exception as e:
         config.logger.error(f"Failed to connect to Azure Blob Storage: {e}")
         return None
 
-def upload_attachment_to_azure(blob_service_client, file_name, file_content):
-    """Uploads a file to Azure Blob Storage and returns the URL."""
-    if not blob_service_client:
-        config.logger.warning(f"Skipping upload for {file_name}: Blob service client is not available.")
+def upload_attachment_to_azure(container_client, file_name, file_content, length=None):
+    """
+    Uploads a file to Azure Blob Storage and returns the URL.
+    file_content may be bytes or an iterator of chunks; chunks are uploaded as they arrive.
+    """
+    if not container_client:
+        config.logger.warning(f"Skipping upload for {file_name}: Blob container client is not available.")
         return None
 
     unique_file_name = f"{uuid.uuid4()}-{file_name}"
     
     try:
-        container_client = blob_service_client.get_container_client(config.AZURE_CONTAINER_NAME)
         blob_client = container_client.get_blob_client(unique_file_name)
         
-        content_type = "application/octet-stream"
-        if file_name.lower().endswith('.pdf'): content_type = "application/pdf"
-        elif file_name.lower().endswith('.txt'): content_type = "text/plain"
-        elif file_name.lower().endswith('.png'): content_type = "image/png"
-        elif file_name.lower().endswith(('.jpg', '.jpeg')): content_type = "image/jpeg"
-            
+        ext = os.path.splitext(file_name)[1].lower()
+        content_type = CONTENT_TYPES.get(ext, "application/octet-stream")
         content_settings = ContentSettings(content_type=content_type)
         
-        blob_client.upload_blob(file_content, content_settings=content_settings)
-        config.logger.debug(f"Uploaded attachment {file_name} to {blob_client.url}")
+        blob_client.upload_blob(file_content, length=length, content_settings=content_settings, overwrite=True)
+        config.logger.debug("Uploaded attachment %s to %s", file_name, blob_client.url)
         return blob_client.url
     except Exception as e:
         config.logger.error(f"Failed to upload attachment {file_name} to Azure: {e}")
         return None
 
-def get_or_create_supplier(session: Session, qb_supplier: QBSupplier) -> models.Supplier:
-    """Finds a supplier by name, or creates it if it doesn't exist."""
+def load_name_index(session: Session, model) -> dict:
+    """Loads {name: id} for every row of a Supplier/Material-like model in one SELECT."""
+    return dict(session.query(model.name, model.id).all())
+
+def load_existing_invoice_numbers(session: Session) -> set:
+    """Loads every invoice number already in the DB in one SELECT."""
+    return {number for (number,) in session.query(models.Invoice.invoice_number).all()}
+
+def load_existing_lpos(session: Session) -> dict:
+    """
+    Loads every LPO already in the DB in one SELECT.
+    Returns {lpo_number: (id, supplier_id, project_id, created_by_id)}.
+    """
+    rows = session.query(
+        models.LPO.lpo_number, models.LPO.id, models.LPO.supplier_id, models.LPO.project_id, models.LPO.created_by_id
+    ).all()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+def get_or_create_supplier(session: Session, qb_supplier: QBSupplier, supplier_index: dict) -> int:
+    """
+    Returns the ID of the supplier with this name, creating it if it doesn't exist.
+    supplier_index ({name: id}) holds every known supplier, so a miss means a new row.
+    """
     supplier_name = qb_supplier.DisplayName
     if not supplier_name:
         raise ValueError(f"QB Supplier ID {qb_supplier.Id} has no DisplayName.")
-        
-    db_supplier = session.query(models.Supplier).filter_by(name=supplier_name).first()
-    
-    if db_supplier:
-        config.logger.debug(f"Found existing supplier: {supplier_name}")
-        return db_supplier
+
+    supplier_id = supplier_index.get(supplier_name)
+    if supplier_id is not None:
+        config.logger.debug("Found existing supplier: %s", supplier_name)
+        return supplier_id
     else:
         config.logger.info(f"Creating new supplier: {supplier_name}")
         new_supplier = models.Supplier(
@@ -76,35 +130,32 @@ def get_or_create_supplier(session: Session, qb_supplier: QBSupplier) -> models.
         )
         session.add(new_supplier)
         session.flush() # Flush to get the new ID
-        return new_supplier
+        supplier_index[supplier_name] = new_supplier.id
+        return new_supplier.id
 
-def get_or_create_material(session: Session, qb_item: QBItem) -> models.Material:
-    """Finds a material by name, or creates it if it doesn't exist."""
+def get_or_create_material(session: Session, qb_item: QBItem, material_index: dict) -> int:
+    """
+    Returns the ID of the material with this name, creating it if it doesn't exist.
+    material_index ({name: id}) holds every known material, so a miss means a new row.
+    """
     material_name = qb_item.Name
     if not material_name:
          raise ValueError(f"QB Item ID {qb_item.Id} has no Name.")
 
-    db_material = session.query(models.Material).filter_by(name=material_name).first()
-    
-    if db_material:
-        config.logger.debug(f"Found existing material: {material_name}")
-        return db_material
+    material_id = material_index.get(material_name)
+    if material_id is not None:
+        config.logger.debug("Found existing material: %s", material_name)
+        return material_id
     else:
         config.logger.info(f"Creating new material: {material_name}")
-        # Map QB Item Type to your 'unit' field, or default to 'nos'
-        unit = 'nos' # Default
-        if qb_item.Type == 'Service':
-            unit = 'service'
-        elif qb_item.Type == 'Inventory':
-            unit = 'each' # You might have a UOM field in QB
-        
         new_material = models.Material(
             name=material_name,
-            unit=unit 
+            unit=_UNIT_BY_QB_TYPE.get(qb_item.Type, 'nos')
         )
         session.add(new_material)
         session.flush() # Flush to get the new ID
-        return new_material
+        material_index[material_name] = new_material.id
+        return new_material.id
 
 def get_default_project(session: Session) -> models.Project:
     """Finds or creates the default project for imported items."""
@@ -131,11 +182,49 @@ def get_default_user(session: Session) -> models.User:
         session.flush()
     return db_user
 
-def process_lpo_items(session: Session, qb_client: QuickBooks, qb_lpo: PurchaseOrder, db_lpo: models.LPO):
-    """Processes and adds line items from a QB LPO to a DB LPO."""
+def prefetch_qb_references(qb_client: QuickBooks, qb_invoices, existing_lpos: dict):
+    """
+    Resolves the linked LPO of every invoice, then bulk fetches every Item
+    and Supplier referenced by the batch so the per-line loops need no API calls.
+    Lines of LPOs already in the DB are not imported again, so they are ignored.
+    Returns (lpo_by_invoice_id, qb_items, qb_suppliers).
+    """
+    item_ids = set()
+    supplier_ids = set()
+
+    # All linked LPOs of the batch, resolved from the invoices' LinkedTxn refs
+    qb_invoices = [inv for inv in qb_invoices if inv.DocNumber] # Others are skipped in the main loop
+    lpo_by_invoice_id = qb.get_lpos_for_invoices_bulk(qb_client, qb_invoices)
+
+    for qb_invoice in qb_invoices:
+        for line in qb_invoice.Line or []:
+            if line.DetailType == 'SalesItemLineDetail' and line.SalesItemLineDetail.ItemRef:
+                item_ids.add(line.SalesItemLineDetail.ItemRef.value)
+
+        qb_lpo = lpo_by_invoice_id[qb_invoice.Id]
+        if not qb_lpo or qb_lpo.DocNumber in existing_lpos:
+            continue
+        if qb_lpo.VendorRef and qb_lpo.VendorRef.value:
+            supplier_ids.add(qb_lpo.VendorRef.value)
+        for line in qb_lpo.Line or []:
+            if line.DetailType == 'ItemBasedExpenseLineDetail' and line.ItemBasedExpenseLineDetail.ItemRef:
+                item_ids.add(line.ItemBasedExpenseLineDetail.ItemRef.value)
+
+    item_ids.discard(None)
+    qb_items = qb.get_materials_bulk(qb_client, item_ids)
+    qb_suppliers = qb.get_suppliers_bulk(qb_client, supplier_ids)
+    return lpo_by_invoice_id, qb_items, qb_suppliers
+
+def process_lpo_items(session: Session, qb_items: dict, material_index: dict,
+                      qb_lpo: PurchaseOrder, lpo_id: int):
+    """
+    Processes line items from a QB LPO and inserts them for a DB LPO
+    in one multi-row INSERT for the DB LPO with ID lpo_id.
+    """
     if not qb_lpo.Line:
         return
-        
+
+    rows = []
     for line in qb_lpo.Line:
         # We only care about Item-based lines, not account lines
         if line.DetailType == 'ItemBasedExpenseLineDetail':
@@ -144,36 +233,43 @@ def process_lpo_items(session: Session, qb_client: QuickBooks, qb_lpo: PurchaseO
                 config.logger.warning(f"Skipping LPO item (no ItemRef): {line.Description}")
                 continue
                 
-            qb_item = qb.get_material(qb_client, detail.ItemRef.value)
+            qb_item = qb_items.get(detail.ItemRef.value)
             if not qb_item:
                 config.logger.error(f"Could not find QB Item {detail.ItemRef.value}. Skipping LPO item.")
                 continue
             
-            db_material = get_or_create_material(session, qb_item)
+            material_id = get_or_create_material(session, qb_item, material_index)
             
             # QB tax rate calculation is complex. We'll simplify.
             # If TaxCodeRef is 'TAX', we assume 5%. This is a simplification.
-            tax_rate = Decimal("0.00")
+            tax_rate = _TAX_ZERO
             if detail.TaxCodeRef and detail.TaxCodeRef.value != 'NON':
                  # You might need to fetch TaxRate objects to be precise
                  # For now, let's use a flat 5% if *any* tax is applied
-                 tax_rate = Decimal("0.05") 
-
-            lpo_item = models.LPOItem(
-                description=line.Description,
-                quantity=detail.Qty or Decimal("0.0"),
-                rate=detail.UnitPrice or Decimal("0.0"),
-                tax_rate=tax_rate,
-                lpo=db_lpo,
-                material_id=db_material.id
-            )
-            session.add(lpo_item)
-            
-def process_invoice_items(session: Session, qb_client: QuickBooks, qb_invoice: Invoice, db_invoice: models.Invoice):
-    """Processes and adds line items from a QB Invoice to a DB Invoice."""
+                 tax_rate = _TAX_STD
+
+            rows.append({
+                'description': line.Description,
+                'quantity': detail.Qty or _AMOUNT_ZERO,
+                'rate': detail.UnitPrice or _AMOUNT_ZERO,
+                'tax_rate': tax_rate,
+                'lpo_id': lpo_id,
+                'material_id': material_id
+            })
+
+    if rows:
+        session.execute(models.LPOItem.__table__.insert(), rows)
+
+def process_invoice_items(session: Session, qb_items: dict, material_index: dict,
+                          qb_invoice: Invoice, invoice_id: int):
+    """
+    Processes line items from a QB Invoice and inserts them for a DB Invoice
+    in one multi-row INSERT for the DB Invoice with ID invoice_id.
+    """
     if not qb_invoice.Line:
         return
 
+    rows = []
     for line in qb_invoice.Line:
         if line.DetailType == 'SalesItemLineDetail':
             detail = line.SalesItemLineDetail
@@ -181,63 +277,129 @@ def process_invoice_items(session: Session, qb_client: QuickBooks, qb_invoice: I
                 config.logger.warning(f"Skipping Invoice item (no ItemRef): {line.Description}")
                 continue
 
-            qb_item = qb.get_material(qb_client, detail.ItemRef.value)
+            qb_item = qb_items.get(detail.ItemRef.value)
             if not qb_item:
                 config.logger.error(f"Could not find QB Item {detail.ItemRef.value}. Skipping Invoice item.")
                 continue
             
-            db_material = get_or_create_material(session, qb_item)
+            material_id = get_or_create_material(session, qb_item, material_index)
             
-            tax_rate = Decimal("0.00")
+            tax_rate = _TAX_ZERO
             if detail.TaxCodeRef and detail.TaxCodeRef.value != 'NON':
-                 tax_rate = Decimal("0.05") # Same simplification as LPO
-
-            inv_item = models.InvoiceItem(
-                description=line.Description,
-                quantity=detail.Qty or Decimal("0.0"),
-                rate=detail.UnitPrice or Decimal("0.0"),
-                tax_rate=tax_rate,
-                # item_class=detail.ClassRef.value if detail.ClassRef else None,
-                invoice=db_invoice,
-                material_id=db_material.id
-            )
-            session.add(inv_item)
-            
-def process_attachments(session: Session, qb_client: QuickBooks, blob_service_client,
-                        qb_object_type: str, qb_object_id: str, db_object):
-    """Downloads QB attachments, uploads to Azure, and links to the DB object."""
-    qb_attachments = qb.get_attachments(qb_client, qb_object_type, qb_object_id)
-    
+                 tax_rate = _TAX_STD # Same simplification as LPO
+
+            rows.append({
+                'description': line.Description,
+                'quantity': detail.Qty or _AMOUNT_ZERO,
+                'rate': detail.UnitPrice or _AMOUNT_ZERO,
+                'tax_rate': tax_rate,
+                # 'item_class': detail.ClassRef.value if detail.ClassRef else None,
+                'invoice_id': invoice_id,
+                'material_id': material_id
+            })
+
+    if rows:
+        session.execute(models.InvoiceItem.__table__.insert(), rows)
+
+def fetch_and_upload_attachment(qb_client: QuickBooks, container_client, att):
+    """Streams one QB attachment into Azure. Returns the blob URL or None."""
+    if not container_client:
+        # Don't open a download that can't be uploaded anywhere
+        config.logger.warning(f"Skipping upload for {att.FileName}: Blob container client is not available.")
+        return None
+    download = qb.stream_attachment(qb_client, att)
+    if download is None:
+        return None # Download failed, already logged
+    response, chunks, length = download
+    try:
+        return upload_attachment_to_azure(container_client, att.FileName, chunks, length)
+    finally:
+        response.close() # Release the QB connection, even if the upload never read it
+
+def process_attachments(session: Session, qb_client: QuickBooks, container_client, executor,
+                        attachments_by_id: dict, qb_object_type: str, qb_object_id: str, db_object_id: int):
+    """
+    Downloads QB attachments, uploads to Azure, and links to the DB object (must have an id).
+    Attachment metadata comes from the pre-fetched attachments_by_id map.
+    File transfers run concurrently on `executor`; DB rows are built on the calling thread
+    since the session is not thread-safe.
+    """
+    qb_attachments = attachments_by_id.get(qb_object_id, [])
+    if qb_attachments is None:
+        # Failing the invoice leaves it to be retried on the next run
+        raise Exception(f"Could not fetch attachment metadata for {qb_object_type} {qb_object_id} from QB.")
+
+    futures = []
     for att in qb_attachments:
         if not att.FileName:
             config.logger.warning(f"Skipping attachment for {qb_object_type} {qb_object_id}: No file name.")
             continue
-            
-        file_content = qb.download_attachment(qb_client, att)
-        if not file_content:
-            continue # Download failed, already logged
+        futures.append((att, executor.submit(fetch_and_upload_attachment, qb_client, container_client, att)))
 
-        blob_url = upload_attachment_to_azure(blob_service_client, att.FileName, file_content)
+    db_attachments = []
+    for att, future in futures:
+        blob_url = future.result()
         if not blob_url:
-            continue # Upload failed, already logged
+            continue # Download or upload failed, already logged
 
         # Create the correct attachment model based on type
         if qb_object_type == 'PurchaseOrder':
             db_att = models.LPOAttachment(
                 blob_url=blob_url,
                 file_name=att.FileName,
-                lpo=db_object
+                lpo_id=db_object_id
             )
         elif qb_object_type == 'Invoice':
             db_att = models.InvoiceAttachment(
                 blob_url=blob_url,
                 file_name=att.FileName,
-                invoice=db_object
+                invoice_id=db_object_id
             )
         else:
             continue
-            
-        session.add(db_att)
+
+        db_attachments.append(db_att)
+
+    if db_attachments:
+        session.bulk_save_objects(db_attachments)
+
+def commit_batch(session: Session, pending_invoices: list) -> bool:
+    """
+    Commits the invoices imported since the last commit.
+    On failure the whole batch is rolled back and False is returned.
+    """
+    if not pending_invoices:
+        return True
+    try:
+        session.commit()
+        config.logger.info(f"Committed batch of {len(pending_invoices)} invoices.")
+        return True
+    except Exception as e:
+        config.logger.error(f"--- FAILED to commit batch of {len(pending_invoices)} invoices "
+                            f"({', '.join(pending_invoices)}): {e} ---")
+        session.rollback()
+        return False
+
+def start_invoice_producer(qb_client: QuickBooks, start_date, end_date, limit=None) -> queue.Queue:
+    """
+    Pages through QB invoices on a background thread so the next page is
+    already in flight while the current one is written to the DB.
+    Returns a queue of invoice pages, terminated by None. If fetching fails part-way,
+    the exception is queued just before the None.
+    """
+    pages = queue.Queue(maxsize=INVOICE_PREFETCH_PAGES)
+
+    def produce():
+        try:
+            for page in qb.iter_invoice_pages(qb_client, start_date, end_date, limit):
+                pages.put(page)
+        except Exception as e:
+            pages.put(e) # Already logged; tells the consumer the range is incomplete
+        finally:
+            pages.put(None) # End of stream
+
+    threading.Thread(target=produce, name='qb-invoice-pages', daemon=True).start()
+    return pages
 
 # --- Main Processing Function ---
 
@@ -260,7 +422,7 @@ def process_imports(limit=None):
 
     # Initialize services
     db: Session = config.SessionLocal()
-    blob_service_client = get_azure_blob_service_client()
+    container_client = get_azure_container_client()
     qb_client = qb.get_qb_client()
     
     if not qb_client:
@@ -268,143 +430,267 @@ def process_imports(limit=None):
         db.close()
         return
 
+    # Shared by every process_attachments call for the whole run
+    attachment_executor = ThreadPoolExecutor(max_workers=ATTACHMENT_WORKERS)
+
     success_count = 0
     skipped_count = 0
     fail_count = 0
+    pending_invoices = [] # Imported but not yet committed
+    fetch_error = None # Set if QB stopped returning pages before the end of the range
     
     try:
         # Get default user/project to assign all items to
-        default_project = get_default_project(db)
-        default_user = get_default_user(db)
+        # Resolved once; only the IDs are carried so no expired ORM object is touched per LPO
+        default_project_id = get_default_project(db).id
+        default_user_id = get_default_user(db).id
+        db.commit() # Persist the defaults so a later per-invoice rollback can't remove them
+
+        # Name -> ID indexes and already-imported Invoices/LPOs, loaded with one SELECT each
+        supplier_index = load_name_index(db, models.Supplier)
+        material_index = load_name_index(db, models.Material)
+        existing_invoice_numbers = load_existing_invoice_numbers(db)
+        existing_lpos = load_existing_lpos(db)
         
-        # 1. Fetch Invoices from QuickBooks
-        qb_invoices = qb.get_invoices(qb_client, start_date, end_date, limit)
-        config.logger.info(f"Found {len(qb_invoices)} invoices in QB to process.")
-
-        for qb_invoice in qb_invoices:
-            invoice_number = qb_invoice.DocNumber
-            if not invoice_number:
-                config.logger.warning(f"Skipping QB Invoice ID {qb_invoice.Id}: It has no Invoice Number (DocNumber).")
-                skipped_count += 1
-                continue
-            
-            try:
-                # 2. Check for Duplicates (Idempotency)
-                existing_invoice = db.query(models.Invoice).filter_by(invoice_number=invoice_number).first()
-                if existing_invoice:
-                    config.logger.warning(f"Skipping Invoice {invoice_number}: Already exists in database.")
+        # 1. Fetch Invoices from QuickBooks, page by page, while earlier pages are imported
+        invoice_pages = start_invoice_producer(qb_client, start_date, end_date, limit)
+
+        for qb_invoices in iter(invoice_pages.get, None):
+            if isinstance(qb_invoices, Exception):
+                fetch_error = qb_invoices
+                continue # The None sentinel follows
+            config.logger.info(f"Found {len(qb_invoices)} invoices in QB to process.")
+
+            # Only invoices that will actually be imported need any QB lookups
+            new_invoices = [inv for inv in qb_invoices
+                            if inv.DocNumber and inv.DocNumber not in existing_invoice_numbers]
+
+            # Resolve LPOs and bulk fetch referenced Items/Suppliers for this page up-front
+            lpo_by_invoice_id, qb_items, qb_suppliers = prefetch_qb_references(qb_client, new_invoices, existing_lpos)
+
+            # Attachment metadata for every new invoice and LPO, one query per type
+            invoice_attachments = qb.get_attachments_bulk(
+                qb_client, 'Invoice', [inv.Id for inv in new_invoices])
+            lpo_attachments = qb.get_attachments_bulk(
+                qb_client, 'PurchaseOrder',
+                {lpo.Id for lpo in lpo_by_invoice_id.values() if lpo and lpo.DocNumber not in existing_lpos})
+
+            for qb_invoice in qb_invoices:
+                invoice_number = qb_invoice.DocNumber
+                if not invoice_number:
+                    config.logger.warning(f"Skipping QB Invoice ID {qb_invoice.Id}: It has no Invoice Number (DocNumber).")
                     skipped_count += 1
                     continue
+            
+                savepoint = None
+                new_lpo = None
+                try:
+                    # 2. Check for Duplicates (Idempotency)
+                    if invoice_number in existing_invoice_numbers:
+                        config.logger.warning(f"Skipping Invoice {invoice_number}: Already exists in database.")
+                        skipped_count += 1
+                        continue
                     
-                # 3. Check for LPO
-                qb_lpo = qb.get_lpo_for_invoice(qb_client, qb_invoice)
-                if not qb_lpo:
-                    config.logger.warning(f"Skipping Invoice {invoice_number}: No related LPO (PurchaseOrder) found in QB.")
-                    skipped_count += 1
-                    continue
+                    # 3. Check for LPO
+                    qb_lpo = lpo_by_invoice_id.get(qb_invoice.Id)
+                    if not qb_lpo:
+                        config.logger.warning(f"Skipping Invoice {invoice_number}: No related LPO (PurchaseOrder) found in QB.")
+                        skipped_count += 1
+                        continue
 
-                lpo_number = qb_lpo.DocNumber
-                if not lpo_number:
-                    config.logger.warning(f"Skipping Invoice {invoice_number}: Linked LPO {qb_lpo.Id} has no LPO Number (DocNumber).")
-                    skipped_count += 1
-                    continue
+                    lpo_number = qb_lpo.DocNumber
+                    if not lpo_number:
+                        config.logger.warning(f"Skipping Invoice {invoice_number}: Linked LPO {qb_lpo.Id} has no LPO Number (DocNumber).")
+                        skipped_count += 1
+                        continue
                     
-                config.logger.debug(f"Processing Invoice {invoice_number}, linked to LPO {lpo_number}")
+                    config.logger.debug("Processing Invoice %s, linked to LPO %s", invoice_number, lpo_number)
 
-                # 4. Process LPO (Find or Create)
-                db_lpo = db.query(models.LPO).filter_by(lpo_number=lpo_number).first()
+                    # Everything this invoice writes can be undone without losing the rest of the batch
+                    savepoint = db.begin_nested()
+
+                    # 4. Process LPO (Find or Create)
+                    db_lpo = existing_lpos.get(lpo_number)
                 
-                if not db_lpo:
-                    config.logger.info(f"LPO {lpo_number} not found. Creating new LPO.")
+                    if not db_lpo:
+                        config.logger.info(f"LPO {lpo_number} not found. Creating new LPO.")
                     
-                    # 4a. Get/Create Supplier
-                    if not qb_lpo.VendorRef or not qb_lpo.VendorRef.value:
-                         raise Exception(f"LPO {lpo_number} has no Supplier (VendorRef).")
+                        # 4a. Get/Create Supplier
+                        if not qb_lpo.VendorRef or not qb_lpo.VendorRef.value:
+                             raise Exception(f"LPO {lpo_number} has no Supplier (VendorRef).")
                     
-                    qb_supplier = qb.get_supplier(qb_client, qb_lpo.VendorRef.value)
-                    if not qb_supplier:
-                        raise Exception(f"Supplier ID {qb_lpo.VendorRef.value} not found in QB.")
-                    db_supplier = get_or_create_supplier(db, qb_supplier)
+                        qb_supplier = qb_suppliers.get(qb_lpo.VendorRef.value)
+                        if not qb_supplier:
+                            raise Exception(f"Supplier ID {qb_lpo.VendorRef.value} not found in QB.")
+                        supplier_id = get_or_create_supplier(db, qb_supplier, supplier_index)
                     
-                    # 4b. Create LPO
-                    db_lpo = models.LPO(
-                        lpo_number=lpo_number,
-                        lpo_date=qb_lpo.TxnDate,
-                        status=qb_lpo.POStatus,
-                        subtotal=qb_lpo.TotalAmt - (qb_lpo.TxnTaxDetail.TotalTax if qb_lpo.TxnTaxDetail else 0),
-                        tax_total=qb_lpo.TxnTaxDetail.TotalTax if qb_lpo.TxnTaxDetail else 0,
-                        grand_total=qb_lpo.TotalAmt,
-                        message_to_supplier=qb_lpo.PrivateNote, # Or ShipTo.Name, etc. Map as needed.
-                        memo=qb_lpo.Memo,
-                        payment_mode=None, # QB POs don't have payment_mode
-                        supplier_id=db_supplier.id,
-                        project_id=default_project.id,
-                        created_by_id=default_user.id
-                    )
-                    db.add(db_lpo)
+                        # 4b. Create LPO (Core INSERT ... RETURNING id, no unit-of-work flush).
+                        # ON CONFLICT DO NOTHING makes this safe against a concurrent import creating it first.
+                        lpo_tax_total = qb_lpo.TxnTaxDetail.TotalTax if qb_lpo.TxnTaxDetail else 0
+                        lpo_id = db.execute(
+                            pg_insert(models.LPO.__table__)
+                            .on_conflict_do_nothing(index_elements=['lpo_number'])
+                            .returning(models.LPO.__table__.c.id),
+                            {
+                                'lpo_number': lpo_number,
+                                'lpo_date': qb_lpo.TxnDate,
+                                'status': qb_lpo.POStatus,
+                                'subtotal': qb_lpo.TotalAmt - lpo_tax_total,
+                                'tax_total': lpo_tax_total,
+                                'grand_total': qb_lpo.TotalAmt,
+                                'message_to_supplier': qb_lpo.PrivateNote, # Or ShipTo.Name, etc. Map as needed.
+                                'memo': qb_lpo.Memo,
+                                'payment_mode': None, # QB POs don't have payment_mode
+                                'supplier_id': supplier_id,
+                                'project_id': default_project_id,
+                                'created_by_id': default_user_id
+                            }
+                        ).scalar_one_or_none()
+
+                        if lpo_id is None:
+                            config.logger.warning(f"LPO {lpo_number} was created by another import meanwhile.")
+                            db_lpo = tuple(db.query(
+                                models.LPO.id, models.LPO.supplier_id, models.LPO.project_id, models.LPO.created_by_id
+                            ).filter_by(lpo_number=lpo_number).one())
+                            existing_lpos[lpo_number] = db_lpo
+                        else:
+                            lpo_supplier_id, lpo_project_id, lpo_created_by_id = supplier_id, default_project_id, default_user_id
+                            new_lpo = (lpo_id, lpo_supplier_id, lpo_project_id, lpo_created_by_id)
                     
-                    # 4c. Process LPO Items
-                    process_lpo_items(db, qb_client, qb_lpo, db_lpo)
+                            # 4c. Process LPO Items
+                            process_lpo_items(db, qb_items, material_index, qb_lpo, lpo_id)
                         
-                    # 4d. Process LPO Attachments
-                    process_attachments(db, qb_client, blob_service_client, 'PurchaseOrder', qb_lpo.Id, db_lpo)
-                    
-                    # We must flush here so the LPO gets an ID before the Invoice uses it
-                    db.flush()
-                    config.logger.info(f"Successfully created new LPO {lpo_number} (ID: {db_lpo.id})")
+                            # 4d. Process LPO Attachments
+                            process_attachments(db, qb_client, container_client, attachment_executor, lpo_attachments, 'PurchaseOrder', qb_lpo.Id, lpo_id)
+                            config.logger.info(f"Successfully created new LPO {lpo_number} (ID: {lpo_id})")
                 
-                else:
-                    config.logger.info(f"Found existing LPO {lpo_number} (ID: {db_lpo.id}). Linking to it.")
+                    if db_lpo:
+                        lpo_id, lpo_supplier_id, lpo_project_id, lpo_created_by_id = db_lpo
+                        config.logger.info(f"Found existing LPO {lpo_number} (ID: {lpo_id}). Linking to it.")
                 
-                # 5. Create Invoice
-                config.logger.info(f"Creating new Invoice {invoice_number}")
+                    # 5. Create Invoice
+                    config.logger.info(f"Creating new Invoice {invoice_number}")
                 
-                db_invoice = models.Invoice(
-                    invoice_number=invoice_number,
-                    invoice_date=qb_invoice.TxnDate,
-                    invoice_due_date=qb_invoice.DueDate,
-                    lpo_id=db_lpo.id,
-                    status="Paid" if qb_invoice.Balance == 0 else "Pending",
-                    subtotal=qb_invoice.TotalAmt - (qb_invoice.TxnTaxDetail.TotalTax if qb_invoice.TxnTaxDetail else 0),
-                    tax_total=qb_invoice.TxnTaxDetail.TotalTax if qb_invoice.TxnTaxDetail else 0,
-                    grand_total=qb_invoice.TotalAmt,
-                    message_to_customer=qb_invoice.CustomerMemo,
-                    memo=qb_invoice.PrivateNote,
-                    payment_mode=None, # You may get this from linked payments
-                    supplier_id=db_lpo.supplier_id, # Inherit from LPO
-                    project_id=db_lpo.project_id,   # Inherit from LPO
-                    created_by_id=db_lpo.created_by_id # Inherit from LPO
-                )
-                db.add(db_invoice)
+                    invoice_tax_total = qb_invoice.TxnTaxDetail.TotalTax if qb_invoice.TxnTaxDetail else 0
+                    invoice_id = db.execute(
+                        models.Invoice.__table__.insert().returning(models.Invoice.__table__.c.id),
+                        {
+                            'invoice_number': invoice_number,
+                            'invoice_date': qb_invoice.TxnDate,
+                            'invoice_due_date': qb_invoice.DueDate,
+                            'lpo_id': lpo_id,
+                            'status': "Paid" if qb_invoice.Balance == 0 else "Pending",
+                            'subtotal': qb_invoice.TotalAmt - invoice_tax_total,
+                            'tax_total': invoice_tax_total,
+                            'grand_total': qb_invoice.TotalAmt,
+                            'message_to_customer': qb_invoice.CustomerMemo,
+                            'memo': qb_invoice.PrivateNote,
+                            'payment_mode': None, # You may get this from linked payments
+                            'supplier_id': lpo_supplier_id, # Inherit from LPO
+                            'project_id': lpo_project_id,   # Inherit from LPO
+                            'created_by_id': lpo_created_by_id # Inherit from LPO
+                        }
+                    ).scalar_one()
                 
-                # 6. Process Invoice Items
-                process_invoice_items(db, qb_client, qb_invoice, db_invoice)
+                    # 6. Process Invoice Items
+                    process_invoice_items(db, qb_items, material_index, qb_invoice, invoice_id)
                 
-                # 7. Process Invoice Attachments
-                process_attachments(db, qb_client, blob_service_client, 'Invoice', qb_invoice.Id, db_invoice)
+                    # 7. Process Invoice Attachments
+                    process_attachments(db, qb_client, container_client, attachment_executor, invoice_attachments, 'Invoice', qb_invoice.Id, invoice_id)
                 
-                # Commit this one transaction (Invoice + new LPO if any)
-                db.commit()
-                config.logger.info(f"--- SUCCESSFULLY IMPORTED INVOICE {invoice_number} ---")
-                success_count += 1
-
-            except Exception as e:
-                config.logger.error(f"--- FAILED to process Invoice {invoice_number}: {e} ---")
-                import traceback
-                config.logger.error(traceback.format_exc())
-                db.rollback() # Roll back changes for this specific invoice
-                fail_count += 1
+                    # Release the SAVEPOINT (Invoice + new LPO if any); committed with its batch
+                    savepoint.commit()
+                    config.logger.info(f"--- SUCCESSFULLY IMPORTED INVOICE {invoice_number} ---")
+                    pending_invoices.append(invoice_number) # Counted as succeeded once committed
+                    existing_invoice_numbers.add(invoice_number)
+                    if new_lpo:
+                        existing_lpos[lpo_number] = new_lpo
+
+                except Exception as e:
+                    config.logger.error(f"--- FAILED to process Invoice {invoice_number}: {e} ---")
+                    import traceback
+                    config.logger.error(traceback.format_exc())
+                    fail_count += 1
+                    if savepoint is not None:
+                        # Roll back changes for this specific invoice only. Also needed after a
+                        # failed flush, which leaves the SAVEPOINT inactive but still current
+                        savepoint.rollback()
+                    else:
+                        # Failed outside the SAVEPOINT, so the open batch can't be trusted either
+                        db.rollback()
+                        fail_count += len(pending_invoices)
+                        pending_invoices = []
+                        existing_invoice_numbers = load_existing_invoice_numbers(db)
+                        existing_lpos = load_existing_lpos(db)
+                    # Rows created by this invoice are gone; re-sync the indexes with the DB
+                    supplier_index = load_name_index(db, models.Supplier)
+                    material_index = load_name_index(db, models.Material)
+
+                if len(pending_invoices) >= COMMIT_BATCH_SIZE:
+                    if commit_batch(db, pending_invoices):
+                        success_count += len(pending_invoices)
+                    else:
+                        fail_count += len(pending_invoices)
+                        supplier_index = load_name_index(db, models.Supplier)
+                        material_index = load_name_index(db, models.Material)
+                        existing_invoice_numbers = load_existing_invoice_numbers(db)
+                        existing_lpos = load_existing_lpos(db)
+                    pending_invoices = []
+
+        if commit_batch(db, pending_invoices):
+            success_count += len(pending_invoices)
+        else:
+            fail_count += len(pending_invoices)
                 
     except Exception as e:
         config.logger.critical(f"A critical error occurred: {e}. Rolling back any pending changes.")
         import traceback
         config.logger.critical(traceback.format_exc())
         db.rollback()
+        fail_count += len(pending_invoices) # Their uncommitted batch was rolled back too
     finally:
+        attachment_executor.shutdown(wait=True)
         db.close()
         config.logger.info("--- Import Process Finished ---")
         config.logger.info(f"Summary: {success_count} Succeeded, {skipped_count} Skipped, {fail_count} Failed.")
+        if fetch_error is not None:
+            config.logger.critical(f"INCOMPLETE: fetching invoices from QuickBooks failed part-way ({fetch_error}).")
+            config.logger.critical("Invoices after that point were not imported. Re-run the import to pick up the rest.")
+
 
+def verify_imports():
+    """
+    Reconciliation scan over every imported Invoice: flags invoices with no items,
+    no linked LPO, or a subtotal that doesn't match the sum of their items.
+    Rows are streamed VERIFY_YIELD_PER at a time from a server-side cursor, with each
+    chunk's items loaded in one SELECT ... IN, so memory stays flat as the table grows.
+    """
+    # expire_on_commit=False: a commit mid-stream must not expire the rows still being yielded
+    db: Session = config.SessionLocal(expire_on_commit=False)
+    checked = 0
+    problems = 0
+    try:
+        stmt = (
+            select(models.Invoice)
+            .options(selectinload(models.Invoice.items), lazyload('*'))
+            .execution_options(yield_per=VERIFY_YIELD_PER)
+        )
+        for invoice in db.execute(stmt).scalars():
+            checked += 1
+            items_total = sum((item.quantity * item.rate for item in invoice.items), _AMOUNT_ZERO)
+            if not invoice.items:
+                config.logger.warning("Invoice %s has no items.", invoice.invoice_number)
+            elif invoice.lpo_id is None:
+                config.logger.warning("Invoice %s is not linked to an LPO.", invoice.invoice_number)
+            elif invoice.subtotal is not None and abs(invoice.subtotal - items_total) > Decimal("0.01"):
+                config.logger.warning("Invoice %s subtotal %s does not match its items total %s.",
+                                      invoice.invoice_number, invoice.subtotal, items_total)
+            else:
+                continue
+            problems += 1
+    finally:
+        db.close()
+    config.logger.info(f"Verification: checked {checked} invoices, {problems} with problems.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Import Invoices and LPOs from QuickBooks.")
@@ -413,6 +699,14 @@ if __name__ == "__main__":
         type=int, 
         help='Limit the number of invoices to import for testing.'
     )
+    parser.add_argument(
+        '--verify', 
+        action='store_true', 
+        help='Check already-imported invoices against their items instead of importing.'
+    )
     args = parser.parse_args()
     
-    process_imports(limit=args.limit)
\ No newline at end of file
+    if args.verify:
+        verify_imports()
+    else:
+        process_imports(limit=args.limit)
\ No newline at end of file
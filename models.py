@@ -24,12 +24,12 @@ lpo_item_project_association = Table('lpo_item_project_association', Base.metada
 
 class Project(Base):
     __tablename__ = 'projects'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     name = Column(String, unique=True, nullable=False)
 
 class User(Base):
     __tablename__ = 'users'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     #username = Column(String, unique=True, nullable=False)
     email = Column(String, unique=True, nullable=False)
     hashed_password = Column(String, nullable=False)
@@ -37,7 +37,7 @@ class User(Base):
 class MaterialRequisition(Base):
     __tablename__ = 'material_requisitions'
     id = Column(Integer, primary_key=True)
-    mr_number = Column(String, unique=True, nullable=False)
+    mr_number = Column(String, unique=True, index=True, nullable=False)
     # Define the relationship as your LPO model expects it
     supplier_id = Column(Integer, ForeignKey('suppliers.id'))
     supplier = relationship("Supplier", back_populates="requisitions")
@@ -49,7 +49,7 @@ class MaterialRequisition(Base):
 class Supplier(Base):
     __tablename__ = 'suppliers'
     id = Column(Integer, primary_key=True)
-    name = Column(String, unique=True, nullable=False)
+    name = Column(String, unique=True, index=True, nullable=False)
     email = Column(String, nullable=True)
     phone = Column(String, nullable=True)
     requisitions = relationship("MaterialRequisition", back_populates="supplier")
@@ -61,8 +61,8 @@ class Supplier(Base):
 
 class Material(Base):
     __tablename__ = 'materials'
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, unique=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, index=True, nullable=False)
     unit = Column(String, nullable=False) # e.g., 'nos', 'kg', 'm', 'ton'
 
     def __str__(self):
@@ -70,8 +70,8 @@ class Material(Base):
 
 class LPO(Base):
     __tablename__ = 'lpos'
-    id = Column(Integer, primary_key=True, index=True)
-    lpo_number = Column(String, unique=True, nullable=False)
+    id = Column(Integer, primary_key=True)
+    lpo_number = Column(String, unique=True, index=True, nullable=False)
     lpo_date = Column(Date, nullable=False, default=func.current_date())
     status = Column(String, nullable=False, default='Pending') # Pending, Approved, Rejected
     subtotal = Column(Numeric(12, 2), nullable=True)
@@ -86,16 +86,18 @@ class LPO(Base):
     project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
     created_by_id = Column(Integer, ForeignKey('users.id'), nullable=False)
 
-    supplier = relationship("Supplier", back_populates="lpos")
-    project = relationship("Project")
-    created_by = relationship("User")
-    items = relationship("LPOItem", back_populates="lpo", cascade="all, delete-orphan")
-    attachments = relationship("LPOAttachment", back_populates="lpo", cascade="all, delete-orphan")
-    material_requisitions = relationship("MaterialRequisition", secondary=lpo_mr_association_table, back_populates="lpos")
+    # Collections load with one extra SELECT ... IN per batch of LPOs (selectin),
+    # many-to-one links are joined into the LPO query itself, so iterating LPOs is not N+1.
+    supplier = relationship("Supplier", back_populates="lpos", lazy="joined")
+    project = relationship("Project", lazy="joined")
+    created_by = relationship("User", lazy="joined")
+    items = relationship("LPOItem", back_populates="lpo", cascade="all, delete-orphan", lazy="selectin")
+    attachments = relationship("LPOAttachment", back_populates="lpo", cascade="all, delete-orphan", lazy="selectin")
+    material_requisitions = relationship("MaterialRequisition", secondary=lpo_mr_association_table, back_populates="lpos", lazy="selectin")
 
 class LPOItem(Base):
     __tablename__ = 'lpo_items'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     description = Column(Text, nullable=True)
     quantity = Column(Numeric(10, 2), nullable=False)
     rate = Column(Numeric(10, 2), nullable=False)
@@ -105,12 +107,12 @@ class LPOItem(Base):
     material_id = Column(Integer, ForeignKey('materials.id'), nullable=False)
 
     lpo = relationship("LPO", back_populates="items")
-    material = relationship("Material")
+    material = relationship("Material", lazy="joined")
     projects = relationship("Project", secondary=lpo_item_project_association)
 
 class LPOAttachment(Base):
     __tablename__ = 'lpo_attachments'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     blob_url = Column(String, nullable=False)
     file_name = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
@@ -120,9 +122,9 @@ class LPOAttachment(Base):
 
 class Invoice(Base):
     __tablename__ = 'invoices'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
-    invoice_number = Column(String, unique=True, nullable=False)
+    invoice_number = Column(String, unique=True, index=True, nullable=False)
     invoice_date = Column(Date, nullable=False, default=func.current_date())
     invoice_due_date = Column(Date, nullable=False, default=lambda: datetime.date.today() + datetime.timedelta(days=30))
     lpo_id = Column(Integer, ForeignKey('lpos.id'), nullable=True) # Link to LPO
@@ -139,17 +141,18 @@ class Invoice(Base):
     project_id = Column(Integer, ForeignKey('projects.id'), nullable=False)
     created_by_id = Column(Integer, ForeignKey('users.id'), nullable=False)
 
+    # Same loading strategy as LPO
     lpo = relationship("LPO")
-    supplier = relationship("Supplier", back_populates="invoices")
-    project = relationship("Project")
-    created_by = relationship("User")
-    items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
-    attachments = relationship("InvoiceAttachment", back_populates="invoice", cascade="all, delete-orphan")
+    supplier = relationship("Supplier", back_populates="invoices", lazy="joined")
+    project = relationship("Project", lazy="joined")
+    created_by = relationship("User", lazy="joined")
+    items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan", lazy="selectin")
+    attachments = relationship("InvoiceAttachment", back_populates="invoice", cascade="all, delete-orphan", lazy="selectin")
 
 
 class InvoiceItem(Base):
     __tablename__ = 'invoice_items'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
     description = Column(Text, nullable=True)
     quantity = Column(Numeric(10, 2), nullable=False)
@@ -163,11 +166,11 @@ class InvoiceItem(Base):
     material_id = Column(Integer, ForeignKey('materials.id'), nullable=False)
     
     invoice = relationship("Invoice", back_populates="items")
-    material = relationship("Material")
+    material = relationship("Material", lazy="joined")
 
 class InvoiceAttachment(Base):
     __tablename__ = 'invoice_attachments'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     blob_url = Column(String, nullable=False)
     file_name = Column(String, nullable=True)
     created_at = Column(DateTime, default=func.now())
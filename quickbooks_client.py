@@ -1,6 +1,14 @@
-import os
+import datetime
+import sqlite3
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
 from quickbooks.client import QuickBooks
+from quickbooks.exceptions import AuthorizationException
 from quickbooks.objects.invoice import Invoice
 from quickbooks.objects.purchaseorder import PurchaseOrder
 from quickbooks.objects.vendor import Vendor as Supplier
@@ -10,73 +18,120 @@ from intuitlib.client import AuthClient
 from quickbooks.objects.company_info import CompanyInfo
 from config import (
     logger, QB_CLIENT_ID, QB_CLIENT_SECRET, QB_ENVIRONMENT, 
-    QB_ACCESS_TOKEN, QB_REFRESH_TOKEN, QB_REALM_ID
+    QB_ACCESS_TOKEN, QB_REFRESH_TOKEN, QB_REALM_ID, QB_TOKEN_DB, QB_SELECT_ALL_FIELDS
 )
 
-def update_env_file(new_access_token, new_refresh_token):
+QB_MAX_RESULTS = 1000 # QB API hard limit on rows per query
+QB_MAX_CONCURRENCY = 8 # QB throttles at 10 concurrent requests per company
+
+# Every QB API request in the process takes a slot first, so the page producer, bulk
+# lookups and attachment downloads together stay under QB's per-company limit
+# whatever their own pool sizes are.
+_qb_slots = threading.BoundedSemaphore(QB_MAX_CONCURRENCY)
+
+# --- Query templates ---
+# Built once at import; every call formats the same text, so identical
+# requests produce byte-identical query strings.
+# Only the Invoice fields import_script reads; the rest of each invoice is never downloaded.
+INVOICE_FIELDS = (
+    "Id", "DocNumber", "TxnDate", "DueDate", "Balance", "TotalAmt",
+    "TxnTaxDetail", "CustomerMemo", "PrivateNote", "LinkedTxn", "Line",
+)
+INVOICE_SELECT = "*" if QB_SELECT_ALL_FIELDS else ", ".join(INVOICE_FIELDS)
+INVOICE_WHERE_TEMPLATE = "TxnDate >= '{start}' AND TxnDate < '{stop}'" # Half-open: [start, stop)
+INVOICE_LIMIT_TEMPLATE = f"SELECT {INVOICE_SELECT} FROM Invoice WHERE {{where}} MAXRESULTS {{max_results}}"
+INVOICE_PAGE_TEMPLATE = f"SELECT {INVOICE_SELECT} FROM Invoice WHERE {{where}} STARTPOSITION {{start_pos}} MAXRESULTS {{max_results}}"
+BY_ID_WHERE_TEMPLATE = "Id IN ({id_list})"
+ANY_ACTIVE_WHERE_TEMPLATE = "Active IN (true, false) AND {where}"
+ATTACHMENT_WHERE_TEMPLATE = "AttachableRef.EntityRef.value = '{object_id}' AND AttachableRef.EntityRef.type = '{object_type}'"
+ATTACHMENTS_WHERE_TEMPLATE = "AttachableRef.EntityRef.value IN ({id_list}) AND AttachableRef.EntityRef.type = '{object_type}'"
+
+# --- Token store ---
+# Refreshed tokens are kept in a small SQLite file instead of rewriting .env:
+# each save is one atomic transaction, safe with several importers running.
+TOKEN_TABLE_DDL = "CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, val TEXT)"
+
+def load_tokens():
     """
-    Updates the .env file with new tokens.
-    This is a robust way to handle token refreshes.
+    Returns (access_token, refresh_token).
+    Tokens saved to QB_TOKEN_DB win; the .env values are used until the first save.
     """
-    env_path = '.env'
-    if not os.path.exists(env_path):
-        logger.warning(".env file not found. Cannot persist new tokens.")
-        return
+    try:
+        with closing(sqlite3.connect(QB_TOKEN_DB)) as conn:
+            conn.execute(TOKEN_TABLE_DDL)
+            tokens = dict(conn.execute("SELECT key, val FROM tokens").fetchall())
+    except sqlite3.Error as e:
+        logger.warning(f"Could not read token store {QB_TOKEN_DB}: {e}. Using tokens from .env.")
+        tokens = {}
+    return tokens.get('QB_ACCESS_TOKEN', QB_ACCESS_TOKEN), tokens.get('QB_REFRESH_TOKEN', QB_REFRESH_TOKEN)
 
+def update_tokens(new_access_token, new_refresh_token):
+    """Saves new tokens to the QB_TOKEN_DB SQLite file in a single transaction."""
     try:
-        with open(env_path, 'r') as f:
-            lines = f.readlines()
-
-        with open(env_path, 'w') as f:
-            for line in lines:
-                if line.startswith('QB_ACCESS_TOKEN='):
-                    f.write(f'QB_ACCESS_TOKEN={new_access_token}\n')
-                elif line.startswith('QB_REFRESH_TOKEN='):
-                    f.write(f'QB_REFRESH_TOKEN={new_refresh_token}\n')
-                else:
-                    f.write(line)
-        logger.info("Successfully updated .env file with new refresh token.")
-    except Exception as e:
-        logger.error(f"Error updating .env file: {e}. New tokens will not be saved.")
+        with closing(sqlite3.connect(QB_TOKEN_DB)) as conn:
+            with conn: # Commits both rows together, or neither
+                conn.execute(TOKEN_TABLE_DDL)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO tokens (key, val) VALUES (?, ?)",
+                    [('QB_ACCESS_TOKEN', new_access_token), ('QB_REFRESH_TOKEN', new_refresh_token)]
+                )
+        logger.info(f"Successfully saved new refresh token to {QB_TOKEN_DB}.")
+    except sqlite3.Error as e:
+        logger.error(f"Error saving tokens to {QB_TOKEN_DB}: {e}. New tokens will not be saved.")
 
 def token_refreshed_callback(auth_client):
     """
     This function is called by the QB client *after* it refreshes the token.
-    We save the new tokens back to the .env file.
+    We save the new tokens to the token store.
     """
     logger.info("QuickBooks token was refreshed.")
-    update_env_file(auth_client.access_token, auth_client.refresh_token)
+    update_tokens(auth_client.access_token, auth_client.refresh_token)
+
+# --- Connection probe cache ---
+# A successful CompanyInfo probe is trusted for COMPANY_PROBE_TTL seconds per company,
+# so repeated get_qb_client() calls don't each spend a round trip on it.
+COMPANY_PROBE_TTL = 300
+_company_probe_expiry = {} # {realm_id: time.monotonic() deadline}
+
+def invalidate_company_probe(realm_id=QB_REALM_ID):
+    """Forgets a cached probe so the next get_qb_client() checks the connection again."""
+    _company_probe_expiry.pop(realm_id, None)
 
 def get_qb_client() -> QuickBooks:
     """
     Initializes and returns an authenticated QuickBooks client.
     Handles automatic token refreshes.
     """
+    access_token, refresh_token = load_tokens()
     try:
         auth_client = AuthClient(
             client_id=QB_CLIENT_ID,
             client_secret=QB_CLIENT_SECRET,
             environment=QB_ENVIRONMENT,
             redirect_uri="http://localhost:8000/callback", # Must match
-            access_token=QB_ACCESS_TOKEN,
-            refresh_token=QB_REFRESH_TOKEN
+            access_token=access_token,
+            refresh_token=refresh_token
         )
         
         client = QuickBooks(
             auth_client=auth_client,
-            refresh_token=QB_REFRESH_TOKEN,
+            refresh_token=refresh_token,
             company_id=QB_REALM_ID,
             minorversion=65 # Specify a recent minor version
         )
         
+        if _company_probe_expiry.get(QB_REALM_ID, 0) > time.monotonic():
+            return client # Probed successfully within the last COMPANY_PROBE_TTL seconds
+
         # Test connection by fetching company info
-        # Test connection by fetching company info
-        company_info_list = CompanyInfo.all(qb=client)
+        with _qb_slots:
+            company_info_list = CompanyInfo.all(qb=client)
         if company_info_list:
             logger.info(f"QuickBooks connection successful for company: {company_info_list[0].CompanyName} (ID: {QB_REALM_ID})")
         else:
             # This case shouldn't happen, but it's good to have
             logger.warning(f"QuickBooks connection successful but could not fetch CompanyInfo (ID: {QB_REALM_ID})")
+        _company_probe_expiry[QB_REALM_ID] = time.monotonic() + COMPANY_PROBE_TTL
         return client
     except Exception as e:
         logger.error(f"Failed to initialize QuickBooks client: {e}")
@@ -84,114 +139,416 @@ def get_qb_client() -> QuickBooks:
         logger.error("If this is your first time, run 'python get_oauth_tokens.py' first.")
         return None
 
-def get_invoices(client: QuickBooks, start_date, end_date, limit=None):
+def _month_windows(start, stop):
+    """Yields half-open (start, stop) date pairs covering [start, stop), one per calendar month."""
+    while start < stop:
+        next_month = (start.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        yield start, min(next_month, stop)
+        start = next_month
+
+def _invoice_where_clause(start: datetime.date, stop: datetime.date):
+    """TxnDate filter for [start, stop); dates are ISO formatted explicitly."""
+    return INVOICE_WHERE_TEMPLATE.format(start=start.isoformat(), stop=stop.isoformat())
+
+def _call_with_token_refresh(client: QuickBooks, call):
     """
-    Fetches invoices from QuickBooks within a date range.
-    Handles pagination.
+    Runs one QB API call. If the access token has expired mid-run, refreshes it
+    once (see _refresh_access_token) and retries the call.
     """
-    query = f"SELECT * FROM Invoice WHERE TxnDate >= '{start_date}' AND TxnDate <= '{end_date}'"
-    if limit:
-        query += f" MAXRESULTS {limit}"
-        
+    stale_token = client.auth_client.access_token
+    try:
+        with _qb_slots:
+            return call()
+    except AuthorizationException:
+        logger.warning("QB: Access token rejected; refreshing and retrying.")
+        _refresh_access_token(client, stale_token)
+    with _qb_slots:
+        return call()
+
+def _id_list(ids):
+    """Quoted, comma-separated IDs for an IN (...) clause."""
+    return ", ".join(f"'{i}'" for i in ids)
+
+def iter_invoice_pages(client: QuickBooks, start_date: datetime.date, end_date: datetime.date,
+                       limit=None, page_size=200):
+    """
+    Yields invoices from QuickBooks within a date range (end_date inclusive), one page (list) at a time,
+    so callers can start processing before the whole range is fetched.
+    The range is split into calendar months and each month is counted first, so exactly
+    the needed pages are requested, QB_MAX_CONCURRENCY at a time across all months,
+    and yielded in date order.
+    A failed fetch is logged and re-raised, so callers can tell a partial range from a complete one.
+    """
+    stop_date = end_date + datetime.timedelta(days=1) # Queried as TxnDate < stop_date
     try:
         if limit:
             # If limited, just one call is needed
-            invoices = Invoice.query(query, qb=client)
+            query = INVOICE_LIMIT_TEMPLATE.format(
+                where=_invoice_where_clause(start_date, stop_date), max_results=limit)
+            with _qb_slots:
+                invoices = Invoice.query(query, qb=client)
             logger.info(f"QB: Found {len(invoices)} invoices (limit of {limit}).")
-            return invoices
-        else:
-            # Handle pagination for full import
-            all_invoices = []
-            start_pos = 1
-            max_results = 100 # QB API limit per call
-            while True:
-                paginated_query = f"{query} STARTPOSITION {start_pos} MAXRESULTS {max_results}"
-                invoices_batch = Invoice.query(paginated_query, qb=client)
-                
-                if not invoices_batch:
-                    break # No more invoices
-                    
-                all_invoices.extend(invoices_batch)
-                start_pos += max_results
-                logger.debug(f"QB: Fetched {len(invoices_batch)} invoices. Total: {len(all_invoices)}")
-            
-            logger.info(f"QB: Found a total of {len(all_invoices)} invoices.")
-            return all_invoices
+            if invoices:
+                yield invoices
+            return
+
+        # Handle pagination for full import
+        where_clauses = [_invoice_where_clause(d0, d1) for d0, d1 in _month_windows(start_date, stop_date)]
+
+        def count_window(where_clause):
+            # count() returns None when QB's response carries no totalCount
+            return _call_with_token_refresh(client, lambda: Invoice.count(where_clause, qb=client)) or 0
+
+        def fetch_page(job):
+            where_clause, start_pos = job
+            query = INVOICE_PAGE_TEMPLATE.format(where=where_clause, start_pos=start_pos, max_results=page_size)
+            return _call_with_token_refresh(client, lambda: Invoice.query(query, qb=client))
+
+        fetched = 0
+        seen_ids = set() # Guards against an invoice showing up in two windows
+        with ThreadPoolExecutor(max_workers=QB_MAX_CONCURRENCY) as executor:
+            totals = list(executor.map(count_window, where_clauses))
+            page_jobs = [
+                (where_clause, start_pos)
+                for where_clause, total in zip(where_clauses, totals)
+                for start_pos in range(1, total + 1, page_size)
+            ]
+            logger.info(f"QB: {sum(totals)} invoices to fetch in {len(page_jobs)} pages over {len(where_clauses)} months.")
+
+            # One window of pages in flight at a time keeps memory bounded when the consumer is slower
+            for window in _chunked(page_jobs, QB_MAX_CONCURRENCY):
+                for invoices_batch in executor.map(fetch_page, window):
+                    invoices_batch = [inv for inv in invoices_batch if inv.Id not in seen_ids]
+                    seen_ids.update(inv.Id for inv in invoices_batch)
+                    fetched += len(invoices_batch)
+                    logger.debug("QB: Fetched %d invoices. Total: %d", len(invoices_batch), fetched)
+                    if invoices_batch:
+                        yield invoices_batch
+
+        logger.info(f"QB: Found a total of {fetched} invoices.")
 
     except Exception as e:
         logger.error(f"Error fetching invoices from QB: {e}")
-        return []
+        raise
 
-def get_lpo_for_invoice(client: QuickBooks, invoice: Invoice):
+def get_invoices(client: QuickBooks, start_date, end_date, limit=None):
     """
-    Checks an invoice for a linked LPO (PurchaseOrder) and returns it.
+    Fetches invoices from QuickBooks within a date range.
+    Handles pagination. Returns an empty list if any page fails.
     """
-    if not invoice.LinkedTxn:
-        return None
+    try:
+        return [invoice for page in iter_invoice_pages(client, start_date, end_date, limit) for invoice in page]
+    except Exception:
+        return [] # Already logged
 
-    for txn in invoice.LinkedTxn:
+def get_linked_lpo_id(invoice: Invoice):
+    """Returns the ID of the LPO (PurchaseOrder) linked to an invoice, or None."""
+    for txn in invoice.LinkedTxn or []:
         # FIX: Use dot notation (txn.TxnType) instead of dictionary .get()
         if txn.TxnType == 'PurchaseOrder':
-            # FIX: Use dot notation (txn.TxnId) here as well
-            lpo_id = txn.TxnId
-            try:
-                lpo = PurchaseOrder.get(lpo_id, qb=client)
-                logger.debug(f"QB: Found linked LPO {lpo.DocNumber} for Invoice {invoice.DocNumber}")
-                return lpo
-            except Exception as e:
-                logger.error(f"QB: Error fetching linked LPO {lpo_id}: {e}")
-                return None
+            return txn.TxnId
     return None
 
-def get_supplier(client: QuickBooks, supplier_id: str):
-    """Fetches a Supplier by its ID."""
+def get_lpo_for_invoice(client: QuickBooks, invoice: Invoice):
+    """
+    Checks an invoice for a linked LPO (PurchaseOrder) and returns it.
+    """
+    lpo_id = get_linked_lpo_id(invoice)
+    if not lpo_id:
+        return None
+
+    lpo = _get_lpo(client, lpo_id)
+    if lpo:
+        logger.debug("QB: Found linked LPO %s for Invoice %s", lpo.DocNumber, invoice.DocNumber)
+    return lpo
+
+# --- Supplier/Item/PurchaseOrder cache ---
+# {(type name, company id, object id): object}; None marks IDs QB reported as missing.
+# The same suppliers/items recur across thousands of invoices, so each is fetched once;
+# least recently used entries are evicted past OBJECT_CACHE_SIZE so memory stays bounded
+# however long the date range (each LPO is only needed once).
+OBJECT_CACHE_SIZE = 4096
+_object_cache = OrderedDict()
+_object_cache_lock = threading.Lock() # Filled from LPO fetch worker threads too
+_NOT_CACHED = object()
+QB_OBJECT_NOT_FOUND = 610 # QB error code for a missing object
+
+def _cache_key(client: QuickBooks, qb_class, object_id):
+    return (qb_class.__name__, client.company_id, object_id)
+
+def _cache_get(key):
+    """Returns the cached object (or None for a known-missing ID), or _NOT_CACHED."""
+    with _object_cache_lock:
+        obj = _object_cache.get(key, _NOT_CACHED)
+        if obj is not _NOT_CACHED:
+            _object_cache.move_to_end(key)
+        return obj
+
+def _cache_put(key, obj):
+    with _object_cache_lock:
+        _object_cache[key] = obj
+        _object_cache.move_to_end(key)
+        while len(_object_cache) > OBJECT_CACHE_SIZE:
+            _object_cache.popitem(last=False)
+
+def clear_cache():
+    """Drops every cached Supplier/Item/PurchaseOrder (for long-running processes)."""
+    with _object_cache_lock:
+        _object_cache.clear()
+
+def _get_one(client: QuickBooks, qb_class, object_id: str, label: str):
+    """Fetches one object by its ID, going through the object cache."""
+    key = _cache_key(client, qb_class, object_id)
+    cached = _cache_get(key)
+    if cached is not _NOT_CACHED:
+        return cached
     try:
-        supplier = Supplier.get(supplier_id, qb=client)
-        return supplier
+        with _qb_slots:
+            obj = qb_class.get(object_id, qb=client)
     except Exception as e:
-        logger.error(f"QB: Error fetching Supplier {supplier_id}: {e}")
+        logger.error(f"QB: Error fetching {label} {object_id}: {e}")
+        if getattr(e, 'error_code', None) == QB_OBJECT_NOT_FOUND:
+            _cache_put(key, None) # Don't ask again for a known-missing ID
         return None
+    _cache_put(key, obj)
+    return obj
+
+def _get_lpo(client: QuickBooks, lpo_id: str):
+    """Fetches an LPO (PurchaseOrder) by its ID."""
+    return _get_one(client, PurchaseOrder, lpo_id, "linked LPO")
+
+def get_supplier(client: QuickBooks, supplier_id: str):
+    """Fetches a Supplier by its ID."""
+    return _get_one(client, Supplier, supplier_id, "Supplier")
 
 def get_material(client: QuickBooks, item_id: str):
     """Fetches an Item by its ID."""
-    try:
-        item = Item.get(item_id, qb=client)
-        return item
-    except Exception as e:
-        logger.error(f"QB: Error fetching Item {item_id}: {e}")
-        return None
+    return _get_one(client, Item, item_id, "Item")
+
+def _chunked(ids, size=QB_MAX_RESULTS):
+    """Splits a collection of IDs into lists of at most `size`."""
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+def _get_by_ids(client: QuickBooks, qb_class, ids, include_inactive=False):
+    """
+    Fetches many objects of one type with `WHERE Id IN (...)` queries,
+    one API call per QB_MAX_RESULTS IDs instead of one call per ID.
+    If a bulk query fails, its IDs are fetched individually, concurrently, so one
+    transient error costs at most the objects that also fail on their own.
+    Cached IDs are not fetched again. Returns a dict of {id: object}.
+    """
+    objects = {}
+    to_fetch = []
+    for object_id in set(ids):
+        cached = _cache_get(_cache_key(client, qb_class, object_id))
+        if cached is _NOT_CACHED:
+            to_fetch.append(object_id)
+        elif cached is not None:
+            objects[object_id] = cached
+
+    failed_ids = []
+    # Sorted so the same IDs always produce the same query text
+    for chunk in _chunked(sorted(to_fetch)):
+        where_clause = BY_ID_WHERE_TEMPLATE.format(id_list=_id_list(chunk))
+        if include_inactive:
+            # Name-list entities only return active rows unless asked otherwise
+            where_clause = ANY_ACTIVE_WHERE_TEMPLATE.format(where=where_clause)
+        try:
+            with _qb_slots:
+                batch = qb_class.where(where_clause, max_results=len(chunk), qb=client)
+        except Exception as e:
+            logger.error(f"QB: Error bulk fetching {qb_class.__name__} objects: {e}")
+            failed_ids.extend(chunk)
+            continue
+        found = {obj.Id: obj for obj in batch}
+        for object_id in chunk:
+            _cache_put(_cache_key(client, qb_class, object_id), found.get(object_id))
+        objects.update(found)
+
+    if failed_ids:
+        logger.warning(f"QB: Fetching {len(failed_ids)} {qb_class.__name__} objects individually after a failed bulk query.")
+        label = qb_class.__name__
+        with ThreadPoolExecutor(max_workers=QB_MAX_CONCURRENCY) as executor:
+            for object_id, obj in zip(failed_ids, executor.map(
+                    lambda i: _get_one(client, qb_class, i, label), failed_ids)):
+                if obj:
+                    objects[object_id] = obj
+    logger.debug("QB: Bulk fetched %d %s objects (%d found incl. cached).", len(to_fetch), qb_class.__name__, len(objects))
+    return objects
+
+def get_suppliers_bulk(client: QuickBooks, supplier_ids):
+    """Fetches Suppliers by ID in bulk. Returns {supplier_id: Supplier}."""
+    return _get_by_ids(client, Supplier, supplier_ids, include_inactive=True)
+
+def get_materials_bulk(client: QuickBooks, item_ids):
+    """Fetches Items by ID in bulk. Returns {item_id: Item}."""
+    return _get_by_ids(client, Item, item_ids, include_inactive=True)
+
+def get_purchaseorders_bulk(client: QuickBooks, lpo_ids):
+    """Fetches LPOs (PurchaseOrders) by ID in bulk. Returns {lpo_id: PurchaseOrder}."""
+    return _get_by_ids(client, PurchaseOrder, lpo_ids)
+
+def get_lpos_for_invoices_bulk(client: QuickBooks, invoices):
+    """
+    Resolves the linked LPO (PurchaseOrder) of many invoices at once.
+    Unique LPO IDs are fetched with bulk queries (falling back to single
+    fetches for any chunk whose query failed).
+    Returns {invoice_id: PurchaseOrder or None}.
+    """
+    lpo_id_by_invoice_id = {inv.Id: get_linked_lpo_id(inv) for inv in invoices}
+    lpo_ids = set(lpo_id_by_invoice_id.values())
+    lpo_ids.discard(None)
+
+    lpos = get_purchaseorders_bulk(client, lpo_ids)
+    return {invoice_id: lpos.get(lpo_id) for invoice_id, lpo_id in lpo_id_by_invoice_id.items()}
 
 def get_attachments(client: QuickBooks, object_type: str, object_id: str):
     """
     Fetches a list of Attachable objects (metadata) for a given QB object.
     object_type = 'Invoice' or 'PurchaseOrder'
     """
-    query = f"SELECT * FROM Attachable WHERE AttachableRef.EntityRef.value = '{object_id}' AND AttachableRef.EntityRef.type = '{object_type}'"
     try:
-        attachments = Attachable.where(query, qb=client)
-        logger.debug(f"QB: Found {len(attachments)} attachments for {object_type} {object_id}")
-        return attachments
+        return _query_attachments(client, object_type, object_id)
     except Exception as e:
         logger.error(f"QB: Error fetching attachments for {object_type} {object_id}: {e}")
         return []
 
-def download_attachment(client: QuickBooks, attachment: Attachable):
+def _query_attachments(client: QuickBooks, object_type: str, object_id: str):
+    """Like get_attachments, but lets errors propagate."""
+    where_clause = ATTACHMENT_WHERE_TEMPLATE.format(object_id=object_id, object_type=object_type)
+    with _qb_slots:
+        attachments = Attachable.where(where_clause, qb=client)
+    logger.debug("QB: Found %d attachments for %s %s", len(attachments), object_type, object_id)
+    return attachments
+
+def get_attachments_bulk(client: QuickBooks, object_type: str, object_ids):
     """
-    Downloads the actual file content of an Attachable.
-    This requires an authenticated request to the FileAccessUri.
+    Fetches Attachable metadata for many QB objects of one type at once.
+    object_type = 'Invoice' or 'PurchaseOrder'
+    Returns {object_id: [Attachable, ...]}; objects without attachments are absent.
+    If a chunk's query fails, its objects are queried one by one; objects whose
+    attachments still could not be fetched map to None, so callers can fail them
+    rather than import them without attachments.
+    """
+    object_ids = set(object_ids)
+    attachments = {}
+    failed_ids = []
+    for chunk in _chunked(sorted(object_ids)):
+        where_clause = ATTACHMENTS_WHERE_TEMPLATE.format(id_list=_id_list(chunk), object_type=object_type)
+        start_pos = 1
+        try:
+            while True:
+                # An object can have several attachments, so a chunk may span pages
+                with _qb_slots:
+                    batch = Attachable.where(where_clause, start_position=start_pos,
+                                             max_results=QB_MAX_RESULTS, qb=client)
+                for att in batch:
+                    for ref in att.AttachableRef or []:
+                        entity = ref.EntityRef
+                        if entity and entity.value in object_ids and entity.type == object_type:
+                            attachments.setdefault(entity.value, []).append(att)
+                if len(batch) < QB_MAX_RESULTS:
+                    break
+                start_pos += QB_MAX_RESULTS
+        except Exception as e:
+            logger.error(f"QB: Error bulk fetching attachments for {object_type}: {e}")
+            failed_ids.extend(chunk)
+
+    if failed_ids:
+        logger.warning(f"QB: Fetching attachments for {len(failed_ids)} {object_type} objects individually after a failed bulk query.")
+
+        def fetch_one(object_id):
+            try:
+                return _query_attachments(client, object_type, object_id)
+            except Exception as e:
+                logger.error(f"QB: Error fetching attachments for {object_type} {object_id}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=QB_MAX_CONCURRENCY) as executor:
+            for object_id, found in zip(failed_ids, executor.map(fetch_one, failed_ids)):
+                # Replaces anything gathered from the failed chunk's earlier pages
+                if found is None or found:
+                    attachments[object_id] = found
+                else:
+                    attachments.pop(object_id, None)
+    logger.debug("QB: Found attachments for %d of %d %s objects", len(attachments), len(object_ids), object_type)
+    return attachments
+
+# --- Attachment downloads ---
+# One keep-alive connection pool shared by every download thread, sized above
+# import_script.ATTACHMENT_WORKERS so threads never wait on (or discard) a connection.
+DOWNLOAD_POOL_SIZE = 16
+DOWNLOAD_TIMEOUT = 60 # Seconds to connect / between bytes
+ATTACHMENT_CHUNK_SIZE = 64 * 1024
+_download_session = None
+_download_lock = threading.Lock()
+
+def _get_download_session():
+    """Returns the shared requests.Session for attachment downloads, creating it on first use."""
+    global _download_session
+    with _download_lock:
+        if _download_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=DOWNLOAD_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _download_session = session
+        return _download_session
+
+def _refresh_access_token(client: QuickBooks, stale_token):
+    """
+    Refreshes the QB access token after a 401 / AuthorizationException, unless another thread already did.
+    Both the auth client and the client's API session get the new tokens,
+    which are also saved to the token store.
+    """
+    auth_client = client.auth_client
+    with _download_lock:
+        if auth_client.access_token != stale_token:
+            return # Refreshed by a concurrent download
+        invalidate_company_probe(client.company_id)
+        auth_client.refresh()
+        # API calls go through client.session, an OAuth2Session holding a copy of the
+        # old tokens; rebuild it so later queries use the new ones too
+        client.refresh_token = auth_client.refresh_token
+        client._start_session()
+        logger.info("QuickBooks token was refreshed.")
+        update_tokens(auth_client.access_token, auth_client.refresh_token)
+
+def stream_attachment(client: QuickBooks, attachment: Attachable):
+    """
+    Streams the file content of an Attachable in 64KB chunks.
+    This requires an authenticated request to the FileAccessUri;
+    an expired access token is refreshed once and the request retried.
+    Returns (response, chunk iterator, content length or None), or None if the download
+    could not start. The caller must close the response once done with the chunks.
     """
     if not attachment.FileAccessUri:
         logger.warning(f"QB: Attachment {attachment.FileName} has no FileAccessUri. Skipping.")
         return None
         
     download_url = attachment.FileAccessUri
+    session = _get_download_session()
     
+    response = None
     try:
-        # We must use the auth client's authenticated session
-        response = client.auth_client.session.get(download_url)
+        for attempt in range(2):
+            access_token = client.auth_client.access_token
+            with _qb_slots: # Held until the headers arrive, not while the body streams
+                response = session.get(download_url, stream=True, timeout=DOWNLOAD_TIMEOUT,
+                                       headers={'Authorization': f"Bearer {access_token}"})
+            if response.status_code != 401 or attempt:
+                break
+            response.close()
+            _refresh_access_token(client, access_token)
         response.raise_for_status() # Raise HTTPError for bad responses (4xx or 5xx)
-        logger.debug(f"QB: Successfully downloaded attachment: {attachment.FileName}")
-        return response.content
-    except requests.exceptions.RequestException as e:
+    except Exception as e: # Token refresh raises intuitlib's AuthClientError, not a RequestException
+        if response is not None:
+            response.close()
         logger.error(f"QB: Failed to download attachment {attachment.FileName}: {e}")
-        return None
\ No newline at end of file
+        return None
+
+    # Content-Length counts encoded bytes; iter_content yields decoded ones
+    length = None if response.headers.get('Content-Encoding') else response.headers.get('Content-Length')
+    return response, response.iter_content(chunk_size=ATTACHMENT_CHUNK_SIZE), int(length) if length else None